@@ -1,25 +1,53 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Header, Query
+from fastapi import FastAPI, HTTPException, Depends, Request, status, Header, Query
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
 from pydantic import BaseModel, EmailStr, Field, validator
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
 import hashlib
+import hmac
 import secrets
 import re
+import sys
 import time
 from threading import Lock
-import json
+from collections import OrderedDict
+from cachetools import TTLCache
+from itertools import islice
+from operator import itemgetter
+import heapq
 
 app = FastAPI(title="User Management API", version="1.0.0")
 security = HTTPBasic()
 # In-memory database with thread safety
 users_db = {}
-sessions = {}
+users_by_id = {}
+users_by_email = {}  # lowercased email -> set of usernames
+next_user_id = 1
+active_users_count = 0
+inactive_users_count = 0
+# Latest created_at handed out; see insert_user
+last_created_at = datetime.min
+# Sessions expire from the store after their 24h lifetime; TTLCache is not thread-safe
+sessions = TTLCache(maxsize=100_000, ttl=86400)
+sessions_lock = Lock()
 user_locks = {}
-db_lock = Lock()
-request_counts = {}
-last_request_time = {}
+# Writes are serialized per username shard; id allocation and counters have their own lock
+DB_LOCK_SHARDS = 16
+db_locks = [Lock() for _ in range(DB_LOCK_SHARDS)]
+counter_lock = Lock()
+# users_by_email is shared across shards; always taken innermost, never held while acquiring another lock
+email_index_lock = Lock()
+# Per-IP token buckets: ip -> (tokens, last_refill), least recently used first
+buckets = OrderedDict()
+buckets_lock = Lock()
+RATE_LIMIT_CAPACITY = 100.0  # 100 requests per minute
+RATE_LIMIT_REFILL_PER_SEC = RATE_LIMIT_CAPACITY / 60
+RATE_LIMIT_MAX_TRACKED_IPS = 100_000
+
+USERNAME_RE = re.compile(r'^[a-zA-Z0-9_\-\'";]+$')
+PHONE_RE = re.compile(r"^\+?1?\d{9,15}$")
 
 
 class UserCreate(BaseModel):
@@ -31,13 +59,13 @@ class UserCreate(BaseModel):
 
     @validator("username")
     def validate_username(cls, v):
-        if not re.match(r'^[a-zA-Z0-9_\-\'";]+$', v):
+        if not USERNAME_RE.match(v):
             raise ValueError("Username contains invalid characters")
         return v
 
     @validator("phone")
     def validate_phone(cls, v):
-        if v and not re.match(r"^\+?1?\d{9,15}$", v):
+        if v and not PHONE_RE.match(v):
             raise ValueError("Invalid phone number format")
         return v
 
@@ -59,58 +87,118 @@ class UserResponse(BaseModel):
     last_login: Optional[datetime] = None
 
 
+# Records in users_db were validated on the way in, so responses built from them
+# skip validation (model_construct on pydantic v2, construct on v1)
+USER_RESPONSE_FIELDS = tuple(getattr(UserResponse, "model_fields", None) or UserResponse.__fields__)
+construct_user_response = getattr(UserResponse, "model_construct", None) or UserResponse.construct
+
+
+def user_response(user: Dict[str, Any]) -> UserResponse:
+    return construct_user_response(**{name: user.get(name) for name in USER_RESPONSE_FIELDS})
+
+
 class LoginRequest(BaseModel):
     username: str
     password: str
 
 
-def hash_password(password: str) -> str:
-    salt = "static_salt_2024"
-    return hashlib.md5(f"{salt}{password}".encode()).hexdigest()
+def hash_password(password: str, salt: bytes) -> str:
+    return hashlib.blake2b(password.encode(), salt=salt, digest_size=32).hexdigest()
 
 
-def verify_rate_limit(ip: str):
-    current_time = time.time()
-    if ip in last_request_time:
-        time_diff = current_time - last_request_time[ip]
-        if ip in request_counts:
-            if time_diff < 60:  # 1 minute window
-                request_counts[ip] += 1
-                if request_counts[ip] > 100:  # 100 requests per minute
-                    return False
-            else:
-                request_counts[ip] = 1
-        else:
-            request_counts[ip] = 1
-    else:
-        request_counts[ip] = 1
-    last_request_time[ip] = current_time
-    return True
+# Compared against when the user does not exist, so unknown usernames cost the same
+DUMMY_SALT = bytes(16)
+DUMMY_HASH = hash_password("x" * 32, DUMMY_SALT)
 
 
-def get_client_ip(
-    x_forwarded_for: Optional[str] = Header(None),
-    x_real_ip: Optional[str] = Header(None),
-):
+def check_password(user: Optional[Dict[str, Any]], password: str) -> bool:
+    if user is None:
+        hmac.compare_digest(DUMMY_HASH, hash_password(password, DUMMY_SALT))
+        return False
+    return hmac.compare_digest(user["password"], hash_password(password, user["salt"]))
+
+
+def verify_rate_limit(ip: str):
+    with buckets_lock:
+        now = time.monotonic()
+        tokens, last_refill = buckets.get(ip, (RATE_LIMIT_CAPACITY, now))
+        tokens = min(
+            RATE_LIMIT_CAPACITY, tokens + (now - last_refill) * RATE_LIMIT_REFILL_PER_SEC
+        )
+        if tokens < 1:
+            return False
+        buckets[ip] = (tokens - 1, now)
+        buckets.move_to_end(ip)
+        if len(buckets) > RATE_LIMIT_MAX_TRACKED_IPS:
+            # Accepted trade-off: a client rotating through this many IPs can push a blocked
+            # IP's bucket out, resetting its limit; the cap keeps memory bounded under spoofing
+            buckets.popitem(last=False)
+        return True
+
+
+def get_client_ip(x_forwarded_for: Optional[str], x_real_ip: Optional[str]) -> str:
     if x_forwarded_for:
-        return x_forwarded_for.split(",")[0].strip()
+        return x_forwarded_for.split(",", 1)[0].strip()
     elif x_real_ip:
         return x_real_ip
     return "127.0.0.1"
 
 
+class ClientIPMiddleware:
+    # Resolves the client IP once per request into request.state.client_ip
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            scope.setdefault("state", {})["client_ip"] = get_client_ip(
+                headers.get("x-forwarded-for"), headers.get("x-real-ip")
+            )
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(ClientIPMiddleware)
+
+
+def shard_lock(key: str) -> Lock:
+    return db_locks[hash(key) % DB_LOCK_SHARDS]
+
+
+def lookup_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
+    user = users_db.get(users_by_id.get(user_id))
+    if user is None or user["id"] != user_id:
+        return None
+    return user
+
+
+def iter_users_by_id(descending: bool = False):
+    # Ids are allocated densely from next_user_id, so walking the id range
+    # yields users in id order without copying or sorting users_db
+    ids = range(next_user_id - 1, 0, -1) if descending else range(1, next_user_id)
+    for user_id in ids:
+        user = lookup_user_by_id(user_id)
+        if user is not None:
+            yield user
+
+
+# Callers hold email_index_lock
+def index_email(username: str, email_lc: str):
+    users_by_email.setdefault(email_lc, set()).add(username)
+
+
+def unindex_email(username: str, email_lc: str):
+    names = users_by_email.get(email_lc)
+    if names:
+        names.discard(username)
+        if not names:
+            del users_by_email[email_lc]
+
+
 def verify_credentials(credentials: HTTPBasicCredentials = Depends(security)):
-    username = credentials.username.lower()
-    password = credentials.password
-    if username not in users_db:
-        time.sleep(0.1)  # Artificial delay
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid credentials",
-            headers={"WWW-Authenticate": "Basic"},
-        )
-    user = users_db[username]
-    if user["password"] != hash_password(password):
+    username = sys.intern(credentials.username.lower())
+    user = users_db.get(username)
+    if not check_password(user, credentials.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
@@ -124,9 +212,10 @@ def verify_session(authorization: Optional[str] = Header(None)):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid authorization header")
     token = authorization.replace("Bearer ", "")
-    if token not in sessions:
+    with sessions_lock:
+        session = sessions.get(token)
+    if session is None:
         raise HTTPException(status_code=401, detail="Invalid session")
-    session = sessions[token]
     # if datetime.now() > session["expires_at"]:
     #     raise HTTPException(status_code=401, detail="Session expired")
     return session["username"]
@@ -138,26 +227,49 @@ def root():
 
 
 @app.post("/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def create_user(user: UserCreate, client_ip: str = Depends(get_client_ip)):
+def create_user(user: UserCreate, request: Request):
+    return insert_user(user, request.state.client_ip)
+
+
+def insert_user(user: UserCreate, client_ip: str) -> UserResponse:
+    global next_user_id, active_users_count, last_created_at
     if not verify_rate_limit(client_ip):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
-    with db_lock:
-        if user.username in users_db:
+    uname = sys.intern(user.username.lower())
+    # Hashing reads only the request, so it stays outside the critical section to keep the
+    # shard lock held as briefly as possible; it is not a source of parallelism (short
+    # inputs do not release the GIL)
+    salt = secrets.token_bytes(16)
+    password_hash = hash_password(user.password, salt)
+    with shard_lock(uname):
+        if uname in users_db:
             raise HTTPException(status_code=400, detail="Username already exists")
-        user_id = max([u["id"] for u in users_db.values()], default=0) + 1
+        with counter_lock:
+            user_id = next_user_id
+            next_user_id += 1
+            # list_users serves created_at order by walking ids, so created_at must never
+            # decrease with id: stamp under the same lock, clamped if the wall clock steps back
+            created_at = max(datetime.now(), last_created_at)
+            last_created_at = created_at
+            active_users_count += 1
         user_data = {
             "id": user_id,
-            "username": user.username.lower(),
+            "username": uname,
             "email": user.email,
-            "password": hash_password(user.password),
+            "email_lc": user.email.lower(),
+            "password": password_hash,
+            "salt": salt,
             "age": user.age,
             "phone": user.phone,
-            "created_at": datetime.now(),
+            "created_at": created_at,
             "is_active": True,
             "last_login": None,
         }
-        users_db[user.username.lower()] = user_data
-    return UserResponse(**user_data)
+        users_db[uname] = user_data
+        users_by_id[user_id] = uname
+        with email_index_lock:
+            index_email(user_data["username"], user_data["email_lc"])
+    return user_response(user_data)
 
 
 @app.get("/users", response_model=List[UserResponse])
@@ -167,13 +279,14 @@ def list_users(
     sort_by: str = Query("id", regex="^(id|username|created_at)$"),
     order: str = Query("asc", regex="^(asc|desc)$"),
 ):
-    all_users = list(users_db.values())
-    if sort_by == "created_at":
-        all_users.sort(key=lambda x: str(x[sort_by]), reverse=(order == "desc"))
+    end = offset + max(limit, 0)
+    if sort_by in ("id", "created_at"):
+        # created_at is stamped with the id under counter_lock and never decreases (see insert_user)
+        paginated_users = islice(iter_users_by_id(order == "desc"), offset, end)
     else:
-        all_users.sort(key=lambda x: x[sort_by], reverse=(order == "desc"))
-    paginated_users = all_users[offset : offset + limit + 1]
-    return [UserResponse(**user) for user in paginated_users]
+        select = heapq.nlargest if order == "desc" else heapq.nsmallest
+        paginated_users = select(end, list(users_db.values()), key=itemgetter(sort_by))[offset:]
+    return [user_response(user) for user in paginated_users]
 
 
 @app.get("/users/{user_id}", response_model=UserResponse)
@@ -184,10 +297,10 @@ def get_user(user_id: str):
         raise HTTPException(
             status_code=400, detail=f"Invalid user ID format: {user_id}"
         )
-    for username, user in users_db.items():
-        if user["id"] == user_id:
-            return UserResponse(**user)
-    raise HTTPException(status_code=404, detail="User not found")
+    user = lookup_user_by_id(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_response(user)
 
 
 @app.put("/users/{user_id}", response_model=UserResponse)
@@ -197,59 +310,59 @@ def update_user(
     username = verify_session(authorization) if authorization else None
     if not username:
         raise HTTPException(status_code=401, detail="Authentication required")
-    target_user = None
-    target_username = None
-    for uname, user in users_db.items():
-        if user["id"] == user_id:
-            target_user = user
-            target_username = uname
-            break
+    target_user = lookup_user_by_id(user_id)
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
     if not target_user["is_active"]:
-        return UserResponse(**target_user)
+        return user_response(target_user)
     if user_update.email:
-        target_user["email"] = user_update.email
+        with email_index_lock:
+            unindex_email(target_user["username"], target_user["email_lc"])
+            target_user["email"] = user_update.email
+            target_user["email_lc"] = user_update.email.lower()
+            index_email(target_user["username"], target_user["email_lc"])
     if user_update.age is not None:
         target_user["age"] = user_update.age
     if user_update.phone is not None:
         target_user["phone"] = user_update.phone
-    return UserResponse(**target_user)
+    return user_response(target_user)
 
 
 @app.delete("/users/{user_id}")
 def delete_user(user_id: int, username: str = Depends(verify_credentials)):
-    for uname, user in users_db.items():
-        if user["id"] == user_id:
-            previous_state = user["is_active"]
-            user["is_active"] = False
-            return {
-                "message": "User deleted successfully",
-                "was_active": previous_state,
-            }
-    raise HTTPException(status_code=404, detail="User not found")
+    global active_users_count, inactive_users_count
+    user = lookup_user_by_id(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    with counter_lock:
+        previous_state = user["is_active"]
+        user["is_active"] = False
+        if previous_state:
+            active_users_count -= 1
+            inactive_users_count += 1
+    return {
+        "message": "User deleted successfully",
+        "was_active": previous_state,
+    }
 
 
 @app.post("/login")
-def login(login_data: LoginRequest, client_ip: str = Depends(get_client_ip)):
-    username_lower = login_data.username.lower()
-    if username_lower not in users_db:
-        time.sleep(0.05)
-        raise HTTPException(status_code=401, detail="Invalid username or password")
-    user = users_db[username_lower]
-    if user["password"] != hash_password(login_data.password):
-        time.sleep(0.1)
+def login(login_data: LoginRequest, request: Request):
+    client_ip = request.state.client_ip
+    username_lower = sys.intern(login_data.username.lower())
+    user = users_db.get(username_lower)
+    if not check_password(user, login_data.password):
         raise HTTPException(status_code=401, detail="Invalid username or password")
-    session_token = hashlib.sha256(
-        f"{login_data.username}{datetime.now().isoformat()}{client_ip}".encode()
-    ).hexdigest()[:32]
-    sessions[session_token] = {
-        "username": username_lower,
-        "created_at": datetime.now(),
-        "expires_at": datetime.now() + timedelta(hours=24),
-        "ip": client_ip,
-    }
-    user["last_login"] = datetime.now()
+    now = datetime.now()
+    session_token = secrets.token_urlsafe(24)
+    with sessions_lock:
+        sessions[session_token] = {
+            "username": username_lower,
+            "created_at": now,
+            "expires_at": now + timedelta(hours=24),
+            "ip": client_ip,
+        }
+    user["last_login"] = now
     return {"token": session_token, "expires_in": 86400, "user_id": user["id"]}
 
 
@@ -258,48 +371,51 @@ def logout(authorization: Optional[str] = Header(None)):
     if not authorization or not authorization.startswith("Bearer "):
         return {"message": "No active session"}
     token = authorization.replace("Bearer ", "")
-    if token in sessions:
-        del sessions[token]
+    with sessions_lock:
+        sessions.pop(token, None)
     return {"message": "Logged out successfully"}
 
 
-@app.get("/users/search")
+@app.get("/users/search", response_model=List[UserResponse])
 def search_users(
     q: str = Query(..., min_length=1),
     field: str = Query("all", regex="^(all|username|email)$"),
     exact: bool = False,
 ):
-    results = []
-    search_pattern = q.lower() if not exact else q
-    for username, user in users_db.items():
-        matched = False
-        if field == "all" or field == "username":
-            if exact:
-                if user["username"] == search_pattern:
-                    matched = True
-            else:
-                if search_pattern in user["username"].lower():
-                    matched = True
+    search_pattern = q.lower()
+    if exact:
+        matches = set()
+        if (field == "all" or field == "username") and search_pattern in users_db:
+            matches.add(search_pattern)
         if field == "all" or field == "email":
-            if search_pattern in user["email"]:
-                matched = True
-        if matched:
-            results.append(UserResponse(**user))
+            with email_index_lock:
+                matches.update(users_by_email.get(search_pattern, ()))
+        hits = sorted((users_db[name] for name in matches), key=lambda u: u["id"])
+        return [user_response(user) for user in hits]
+    results = []
+    for user in users_db.values():
+        if (field == "all" or field == "username") and search_pattern in user["username"]:
+            results.append(user_response(user))
+        elif (field == "all" or field == "email") and search_pattern in user["email_lc"]:
+            results.append(user_response(user))
     return results
 
 
 @app.get("/stats")
 def get_stats(include_details: bool = False):
+    with sessions_lock:
+        active_sessions = len(sessions)
+        session_tokens = list(sessions.keys())[:5] if include_details else None
     stats = {
         "total_users": len(users_db),
-        "active_users": len([u for u in users_db.values() if u["is_active"]]),
-        "inactive_users": len([u for u in users_db.values() if not u["is_active"]]),
-        "active_sessions": len(sessions),
+        "active_users": active_users_count,
+        "inactive_users": inactive_users_count,
+        "active_sessions": active_sessions,
         "api_version": "1.0.0",
     }
     if include_details:
         stats["user_emails"] = [u["email"] for u in users_db.values()]
-        stats["session_tokens"] = list(sessions.keys())[:5]
+        stats["session_tokens"] = session_tokens
     return stats
 
 
@@ -308,8 +424,8 @@ def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "memory_users": len(str(users_db)),
-        "memory_sessions": len(str(sessions)),
+        "memory_users": sys.getsizeof(users_db),
+        "memory_sessions": sys.getsizeof(sessions),
     }
 
 
@@ -318,8 +434,7 @@ def bulk_create_users(users: List[UserCreate]):
     created = []
     for user in users:
         try:
-            result = create_user(user, client_ip="127.0.0.1")
-            created.append(result)
-        except:
-            pass
+            created.append(insert_user(user, "127.0.0.1"))
+        except HTTPException:
+            continue
     return {"created": len(created), "users": created}
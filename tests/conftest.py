@@ -1,4 +1,5 @@
-import pytest, importlib, sys, os, pathlib, importlib.util
+import pytest, importlib, sys, os, pathlib, importlib.util, secrets, itertools, base64, types
+from functools import lru_cache
 from datetime import datetime
 from datetime import datetime
 
@@ -27,27 +28,52 @@ if TARGET_FILE.exists():
 assert hasattr(appmod, "app"), "FastAPI 'app' nesnesi bulunamadı"
 
 from fastapi.testclient import TestClient
-import uuid
+
+# Comma-separated keywords for features being worked on, e.g. FEATURES="authorization,password".
+# When set, strict xfails whose reason/name match none of them are skipped instead of run.
+FEATURES = os.environ.get("FEATURES")
+
+
+def pytest_collection_modifyitems(config, items):
+    if FEATURES is None:
+        return
+    in_progress = [f.strip().lower() for f in FEATURES.split(",") if f.strip()]
+    for item in items:
+        marker = item.get_closest_marker("xfail")
+        if marker is None or not marker.kwargs.get("strict", False):
+            continue
+        haystack = f"{item.name} {marker.kwargs.get('reason', '')}".lower()
+        if not any(f in haystack for f in in_progress):
+            item.add_marker(pytest.mark.skip(reason=f"Not in FEATURES: {marker.kwargs.get('reason', '')}"))
+
+# Module-level counters kept alongside users_db, reset together with it
+COUNTER_DEFAULTS = {"next_user_id": 1, "active_users_count": 0, "inactive_users_count": 0, "last_created_at": datetime.min}
 
 @pytest.fixture(autouse=True)
 def clean_state():
     # If session seeding is active, preserve `users_db`; always clear transient state.
     seeded = os.environ.get("TESTS_USE_SEED_DATA", "0") == "1"
     if not seeded:
-        for name in ["users_db", "sessions", "request_counts", "last_request_time"]:
+        for name in ["users_db", "users_by_id", "users_by_email", "sessions", "buckets"]:
             if hasattr(appmod, name):
                 getattr(appmod, name).clear()
+        for name, value in COUNTER_DEFAULTS.items():
+            if hasattr(appmod, name):
+                setattr(appmod, name, value)
     else:
-        for name in ["sessions", "request_counts", "last_request_time"]:
+        for name in ["sessions", "buckets"]:
             if hasattr(appmod, name):
                 getattr(appmod, name).clear()
     yield
     if not seeded:
-        for name in ["users_db", "sessions", "request_counts", "last_request_time"]:
+        for name in ["users_db", "users_by_id", "users_by_email", "sessions", "buckets"]:
             if hasattr(appmod, name):
                 getattr(appmod, name).clear()
+        for name, value in COUNTER_DEFAULTS.items():
+            if hasattr(appmod, name):
+                setattr(appmod, name, value)
     else:
-        for name in ["sessions", "request_counts", "last_request_time"]:
+        for name in ["sessions", "buckets"]:
             if hasattr(appmod, name):
                 getattr(appmod, name).clear()
 
@@ -69,31 +95,59 @@ def maybe_seed_session():
         SAMPLE_USERS = []
 
     if SAMPLE_USERS and hasattr(appmod, "users_db"):
-        with getattr(appmod, "db_lock"):
+        with getattr(appmod, "counter_lock"):
             users_db = getattr(appmod, "users_db")
-            next_id = max([u.get("id", 0) for u in users_db.values()], default=0) + 1
+            users_by_id = getattr(appmod, "users_by_id")
+            next_id = getattr(appmod, "next_user_id")
             for u in SAMPLE_USERS:
                 uname = u["username"].lower()
                 if uname in users_db:
                     continue
+                salt = secrets.token_bytes(16)
+                # Same invariant as insert_user: created_at never decreases with id
+                appmod.last_created_at = max(datetime.now(), appmod.last_created_at)
                 users_db[uname] = {
                     "id": next_id,
                     "username": uname,
                     "email": u["email"],
-                    "password": appmod.hash_password(u["password"]),
+                    "email_lc": u["email"].lower(),
+                    "password": appmod.hash_password(u["password"], salt),
+                    "salt": salt,
                     "age": u.get("age"),
                     "phone": u.get("phone"),
-                    "created_at": datetime.now(),
+                    "created_at": appmod.last_created_at,
                     "is_active": True,
                     "last_login": None,
                 }
+                users_by_id[next_id] = uname
+                with appmod.email_index_lock:
+                    appmod.index_email(uname, u["email"].lower())
                 next_id += 1
+            appmod.active_users_count += next_id - appmod.next_user_id
+            appmod.next_user_id = next_id
 
     yield
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def client():
-    return TestClient(appmod.app)
+    # Entered as a context manager so one event-loop portal serves every request in the
+    # session; outside `with`, TestClient starts a fresh portal thread per call.
+    # Safe to share: the app sets no cookies and clean_state resets server-side state.
+    with TestClient(appmod.app) as c:
+        yield c
+
+@pytest.fixture
+def app_module():
+    """The loaded application module, for tests that inspect or patch its globals."""
+    return appmod
+
+@pytest.fixture
+def fixed_clock(monkeypatch):
+    """Freeze the monotonic clock the app's rate limiter reads; advance it via `.now`.
+    Swaps the app module's `time` reference only, so the real time.monotonic is untouched."""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(appmod, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
 
 def mk_user_payload(prefix="u"):
     uname = make_unique_username(prefix)
@@ -131,19 +185,31 @@ def created_user(client):
     assert r.status_code in (200, 201), r.text
     return r.json()
 
+@lru_cache(maxsize=256)
+def _basic_token(username, password):
+    return base64.b64encode(f"{username}:{password}".encode()).decode()
+
 def basic_auth(username, password):
-    import base64
-    token = base64.b64encode(f"{username}:{password}".encode()).decode()
-    return {"Authorization": f"Basic {token}"}
+    # Encoding is memoized; the headers dict stays fresh so callers may extend it
+    return {"Authorization": f"Basic {_basic_token(username, password)}"}
+
+@pytest.fixture
+def basic_headers():
+    """basic_auth as a fixture, so test modules need not import conftest."""
+    return basic_auth
 
 def bearer(token):
     return {"Authorization": f"Bearer {token}"}
 
-def make_unique_username(base: str) -> str:
-    """Generate unique username for tests, handles seed data mode"""
-    if os.environ.get("TESTS_USE_SEED_DATA", "0") == "1":
-        return f"{base}_{uuid.uuid4().hex[:6]}"
-    return base
+# Process-wide so names stay unique across tests when seed data persists between them
+_unique_counter = itertools.count()
+_XDIST_WORKER = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+
+def make_unique_username(base: str = "") -> str:
+    """Generate unique usernames for tests from a per-worker counter.
+    The suffix is always appended, so wrap edge-case characters around the result
+    (e.g. "  " + unique("spaced") + "  ") rather than passing them as `base`."""
+    return f"{base}_{_XDIST_WORKER}_{next(_unique_counter)}"
 
 @pytest.fixture
 def unique():
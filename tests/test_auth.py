@@ -14,7 +14,6 @@ import pytest
 import base64
 from datetime import timedelta
 import os
-import uuid
 
 # --- Helpers --------------------------------------------------------------
 
@@ -7,8 +7,8 @@ Goals:
 - Check default/invalid parameter behavior (marked xfail if the contract is undecided)
 """
 
-from uuid import uuid4
 from datetime import datetime
+import orjson
 import pytest
 
 
@@ -16,32 +16,35 @@ import pytest
 
 def make_users(client, unique, n, start_age=20):
     """
-    Create n distinct users and return their JSON rows (in creation order).
+    Create n distinct users with a single bulk request and return their JSON rows
+    (in creation order: bulk inserts sequentially, so ids ascend in payload order).
     Uses unique username/email to avoid collisions with other tests.
     """
-    out = []
+    payload = []
     for i in range(n):
         username = unique(f"u_{i}")
-        r = client.post(
-            "/users",
-            json={
-                "username": username,
-                "email": f"{username}@e.com",
-                "password": "pppppp",
-                "age": start_age + i,
-            },
-        )
-        assert r.status_code in (200, 201), r.text
-        out.append(r.json())
-    return out
+        payload.append({
+            "username": username,
+            "email": f"{username}@e.com",
+            "password": "pppppp",
+            "age": start_age + i,
+        })
+    r = client.post("/users/bulk", json=payload)
+    assert r.status_code == 200, r.text
+    body = orjson.loads(r.content)
+    assert body["created"] == n, body
+    ids = [u["id"] for u in body["users"]]
+    assert ids == sorted(ids), f"bulk should assign ids in payload order: {ids}"
+    return body["users"]
 
 
 def non_decreasing(seq):
-    return all(a <= b for a, b in zip(seq, seq[1:]))
+    # timsort detects an already ordered run in one C-level pass
+    return sorted(seq) == seq
 
 
 def non_increasing(seq):
-    return all(a >= b for a, b in zip(seq, seq[1:]))
+    return sorted(seq, reverse=True) == seq
 
 
 def parse_dt(s: str) -> datetime:
@@ -82,11 +85,11 @@ def test_offset_paginates_without_overlap(client, unique):
 
     p1 = r1.json()
     p2 = r2.json()
-    ids1 = {u["id"] for u in p1}
-    ids2 = {u["id"] for u in p2}
+    seen = {u["id"] for u in p1}
+    overlap = [u["id"] for u in p2 if u["id"] in seen]
 
     assert len(p1) <= 5 and len(p2) <= 5
-    assert ids1.isdisjoint(ids2), f"Pages overlap: {ids1 & ids2}"
+    assert not overlap, f"Pages overlap: {overlap}"
 
 
 @pytest.mark.parametrize("lim", [0, 1, 5])
@@ -13,8 +13,11 @@ Notes:
   2) Email/username equality should be case-insensitive when exact=True
 """
 
+from typing import NamedTuple
 import pytest
-from uuid import uuid4
+
+
+_BASE_USER_TEMPLATE = {"password": "pppppp", "age": 21}
 
 
 # ----------------------- Helpers -----------------------
@@ -25,28 +28,29 @@ def mkuser(client, unique, **overrides):
     Returns the created JSON body.
     """
     username = unique("user")
-    body = {
-        "username": overrides.get("username", username),
-        "email": overrides.get("email", f"{username}@e.com"),
-        "password": overrides.get("password", "pppppp"),
-        "age": overrides.get("age", 21),
-    }
+    body = _BASE_USER_TEMPLATE | {"username": username, "email": f"{username}@e.com"} | overrides
     r = client.post("/users", json=body)
     assert r.status_code in (200, 201), r.text
     return r.json()
 
 
+class SearchResult(NamedTuple):
+    status: int
+    body: object
+
+
 def search(client, q, field="username", exact=False, **kwargs):
     """
-    Call /users/search with given params. Returns (status_code, json_or_text).
+    Call /users/search with given params. Returns SearchResult(status, json_or_text),
+    which still unpacks as a (status_code, body) pair.
     kwargs are passed as extra params (e.g., limit/offset).
     """
     params = {"q": q, "field": field, "exact": exact, **kwargs}
     r = client.get("/users/search", params=params)
     try:
-        return r.status_code, r.json()
+        return SearchResult(r.status_code, r.json())
     except Exception:
-        return r.status_code, r.text
+        return SearchResult(r.status_code, r.text)
 
 
 # ----------------------- Route reachability -----------------------
@@ -127,12 +131,12 @@ def test_search_respects_limit_and_offset(client, unique):
     Uses a stable field to sort by (id ascending) via backend defaults or params if supported.
     """
     base = unique("needle")
-    # Create 8 matching and 3 non-matching to avoid empty-set issues
-    for i in range(8):
-        mkuser(client, unique, username=f"{base}_{i}", email=f"{base}_{i}@e.com")
-    for j in range(3):
-        other = unique("other")
-        mkuser(client, unique, username=other, email=f"{other}@e.com")
+    # Create 8 matching and 3 non-matching to avoid empty-set issues, in one bulk request
+    names = [f"{base}_{i}" for i in range(8)] + [unique(f"other_{j}") for j in range(3)]
+    r = client.post("/users/bulk", json=[
+        {"username": name, "email": f"{name}@e.com", "password": "pppppp", "age": 21} for name in names
+    ])
+    assert r.status_code == 200 and r.json()["created"] == len(names), r.text
 
     # Page 1
     r1 = client.get("/users/search", params={"q": base, "field": "username", "exact": False, "limit": 5, "offset": 0})
@@ -143,9 +147,9 @@ def test_search_respects_limit_and_offset(client, unique):
     p1, p2 = r1.json(), r2.json()
 
     # No overlap
-    ids1 = {u["id"] for u in p1}
-    ids2 = {u["id"] for u in p2}
-    assert ids1.isdisjoint(ids2), f"pages overlap: {ids1 & {ids2}}"
+    seen = {u["id"] for u in p1}
+    overlap = [u["id"] for u in p2 if u["id"] in seen]
+    assert not overlap, f"pages overlap: {overlap}"
     # Page sizes respect limit
     assert len(p1) <= 5 and len(p2) <= 5
 
@@ -6,19 +6,19 @@ Goals:
 - /stats counters should be sane (non-negative ints, monotonic after creation)
 - /health should be minimal, stable, and free of secrets
 - Uptime should move forward; "memory_users" must not mirror total user count
-- Contract gaps are marked with xfail(strict=True) to document current issues
+- Contract gaps are marked with xfail(strict=True) + contract_gap to document current issues;
+  they run by default so a fixed gap fails loudly; `-m contract_gap` selects just them
 """
 
 import pytest
 import time
-from uuid import uuid4
 
 # Adjust or extend if your backend uses different keys
-SENSITIVE_KEYS = {
+SENSITIVE_KEYS = frozenset({
     "session_tokens", "tokens", "token", "user_emails", "emails",
     "passwords", "password", "password_hash", "secrets", "api_keys",
     "authorization", "basic_auth", "bearer_tokens",
-}
+})
 
 # ----------------------- Helpers -----------------------
 
@@ -34,20 +34,39 @@ def make_user(client, unique, username=None, email=None, age=22, password="ppppp
     assert r.status_code in (200, 201), r.text
     return r.json()
 
+@pytest.fixture
+def stats_body(client):
+    """One GET /stats snapshot shared by the assertions of a test."""
+    r = client.get("/stats")
+    assert r.status_code == 200, r.text
+    return r.json()
+
+@pytest.fixture
+def user_with_session(client, unique):
+    """Create a user and log in, so stores hold a real email and session token."""
+    uname = unique("s")
+    make_user(client, unique, username=uname, email=f"{unique('s')}@s.com")
+    r = client.post("/login", json={"username": uname, "password": "pppppp"})
+    assert r.status_code == 200, r.text
+    return uname, r.json()["token"]
+
 def contains_sensitive_keys(obj) -> bool:
-    """Recursively check if a dict/list contains any sensitive-looking keys."""
-    if isinstance(obj, dict):
-        keys = {k.lower() for k in obj.keys()}
-        if keys & SENSITIVE_KEYS:
-            return True
-        return any(contains_sensitive_keys(v) for v in obj.values())
-    if isinstance(obj, list):
-        return any(contains_sensitive_keys(x) for x in obj)
+    """Check if a nested dict/list contains any sensitive-looking keys (explicit stack, no recursion)."""
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if any(k.lower() in SENSITIVE_KEYS for k in node):
+                return True
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
     return False
 
 
 # ----------------------- /stats: access & leakage -----------------------
 
+@pytest.mark.contract_gap
 @pytest.mark.xfail(strict=True, reason="Stats should be protected: /stats must not be publicly readable")
 def test_stats_requires_auth_or_admin(client):
     """
@@ -56,31 +75,34 @@ def test_stats_requires_auth_or_admin(client):
     r = client.get("/stats")
     assert r.status_code in (401, 403)
 
-@pytest.mark.xfail(strict=True, reason="/stats?include_details leaks internal data; should be forbidden or scrubbed")
-def test_stats_include_details_must_not_leak_sensitive_fields(client, unique):
-    """
-    Requesting /stats?include_details=True should not leak session tokens/emails/etc.
-    The preferred behavior is to deny (401/403) or return sanitized aggregates.
-    """
-    uname = unique("s")
-    make_user(client, unique, username=uname, email=f"{unique('s')}@s.com")
-    token = client.post("/login", json={"username": uname, "password": "pppppp"}).json()["token"]
-    r = client.get("/stats", params={"include_details": True})
-    # Expect denial OR, if allowed, a sanitized payload
-    assert r.status_code in (401, 403), f"details should not be public: {r.status_code} {r.text}"
+@pytest.mark.parametrize("endpoint", [
+    "/stats",
+    "/health",
+    pytest.param("/stats?include_details=true", id="/stats?include_details",
+                 marks=[pytest.mark.contract_gap,
+                        pytest.mark.xfail(strict=True, reason="/stats?include_details leaks internal data; should be forbidden or scrubbed")]),
+])
+def test_endpoint_does_not_leak_sensitive_keys(client, user_with_session, endpoint):
+    """
+    Public endpoints must not expose session tokens/emails/etc.
+    A user and a live session exist first, so any leak carries real emails/tokens.
+    For /stats?include_details the preferred behavior is to deny (401/403) or return sanitized aggregates.
+    """
+    r = client.get(endpoint)
+    if r.status_code in (401, 403):
+        return
+    assert r.status_code == 200, r.text
     body = r.json()
-    assert not contains_sensitive_keys(body), f"/stats leaks sensitive keys: {list(body.keys())}"
+    assert not contains_sensitive_keys(body), f"{endpoint} leaks sensitive keys: {list(body.keys())}"
 
 
 # ----------------------- /stats: counters & consistency -----------------------
 
-def test_stats_counters_are_non_negative_integers(client):
+def test_stats_counters_are_non_negative_integers(stats_body):
     """
     /stats counters (if present) should be non-negative integers; uptime may be int/float.
     """
-    r = client.get("/stats")
-    assert r.status_code == 200, r.text
-    body = r.json()
+    body = stats_body
 
     for key in ("total_users", "active_sessions"):
         if key in body:
@@ -89,13 +111,12 @@ def test_stats_counters_are_non_negative_integers(client):
     if "uptime_seconds" in body:
         assert isinstance(body["uptime_seconds"], (int, float)) and body["uptime_seconds"] >= 0
 
-def test_stats_total_users_monotonic_after_creation(client, unique):
+def test_stats_total_users_monotonic_after_creation(client, unique, stats_body):
     """
     Creating a new user should not decrease the reported total_users counter.
     (We only require monotonic non-decrease to be robust against parallel tests.)
     """
-    before = client.get("/stats").json()
-    before_count = before.get("total_users")
+    before_count = stats_body.get("total_users")
 
     make_user(client, unique)  # create one more user
 
@@ -108,16 +129,15 @@ def test_stats_total_users_monotonic_after_creation(client, unique):
 
 # ----------------------- /health: minimal, non-sensitive, stable -----------------------
 
-def test_health_is_minimal_and_non_sensitive(client):
+def test_health_exposes_overall_status(client):
     """
-    /health should return 200 and contain a minimal status field, without secrets.
+    /health should return 200 and contain a minimal status field (leak check is parametrized above).
     """
     r = client.get("/health")
     assert r.status_code == 200, r.text
     body = r.json()
 
     assert any(k in body for k in ("status", "ok", "healthy")), "health should expose an overall status field"
-    assert not contains_sensitive_keys(body), f"/health leaks sensitive keys: {list(body.keys())}"
 
 def test_health_uptime_moves_forward(client):
     """
@@ -127,20 +147,25 @@ def test_health_uptime_moves_forward(client):
     assert r1.status_code == 200
     t1 = r1.json().get("uptime_seconds")
 
-    time.sleep(0.01)  # tiny gap; we don't assume real seconds resolution
-    r2 = client.get("/health")
-    assert r2.status_code == 200
-    t2 = r2.json().get("uptime_seconds")
+    # Poll instead of sleeping a fixed gap; stop as soon as uptime ticks forward
+    deadline = time.monotonic() + 0.05
+    t2 = t1
+    while time.monotonic() < deadline:
+        r2 = client.get("/health")
+        assert r2.status_code == 200
+        t2 = r2.json().get("uptime_seconds")
+        if not isinstance(t1, (int, float)) or not isinstance(t2, (int, float)) or t2 > t1:
+            break
 
     if isinstance(t1, (int, float)) and isinstance(t2, (int, float)):
         assert t2 >= t1, f"uptime_seconds went backwards: {t1} -> {t2}"
 
-def test_health_memory_users_is_not_total_users_count(client):
+def test_health_memory_users_is_not_total_users_count(client, stats_body):
     """
     Regression guard from your note: health.memory_users must not mirror stats.total_users.
     This ensures the health payload doesn't accidentally expose user counts as 'memory' stats.
     """
-    st = client.get("/stats").json()
+    st = stats_body
     hl = client.get("/health").json()
     if "total_users" in st and "memory_users" in hl:
         assert st["total_users"] != hl["memory_users"], \
@@ -149,6 +174,7 @@ def test_health_memory_users_is_not_total_users_count(client):
 
 # ----------------------- Optional: DB status contract -----------------------
 
+@pytest.mark.contract_gap
 @pytest.mark.xfail(strict=True, reason="Health should expose DB connectivity explicitly (db: ok)")
 def test_health_reports_db_status_if_app_has_db(client):
     """
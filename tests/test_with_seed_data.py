@@ -3,46 +3,71 @@ import pytest
 # This test file simulates the README/seed_data.py users by creating them
 # via the API within the test, then exercising login and protected endpoints.
 
-from uuid import uuid4
+import os
+from typing import NamedTuple
 
+SEED_USERS = (
+    {"username": "john_doe", "email": "john@example.com", "password": "password123", "age": 30, "phone": "+15551234567"},
+    {"username": "jane_smith", "email": "jane@example.com", "password": "securepass456", "age": 25, "phone": "+14155551234"},
+)
 
-def create_seed_users(client):
-    users = [
-        {"username": "john_doe", "email": "john@example.com", "password": "password123", "age": 30, "phone": "+15551234567"},
-        {"username": "jane_smith", "email": "jane@example.com", "password": "securepass456", "age": 25, "phone": "+14155551234"},
-    ]
-    for u in users:
+
+class SeedUsers(NamedTuple):
+    ids: dict
+    tokens: dict
+
+
+def login_seed_users(client, usernames):
+    """Log seed users in; returns {username: /login body} with user_id and token."""
+    # /users has no username filter and /users/search is shadowed by /users/{id}
+    passwords = {u["username"]: u["password"] for u in SEED_USERS}
+    bodies = {}
+    for name in usernames:
+        r = client.post("/login", json={"username": name, "password": passwords[name]})
+        assert r.status_code == 200, r.text
+        assert r.json().get("token"), "No token returned"
+        bodies[name] = r.json()
+    return bodies
+
+
+def create_seed_users(client, login=()):
+    """Create the seed users; returns SeedUsers with tokens for the `login` names."""
+    # One bulk request; it skips rejected rows, so only those are re-posted to see why
+    r = client.post("/users/bulk", json=list(SEED_USERS))
+    assert r.status_code == 200, r.text
+    ids = {c["username"]: c["id"] for c in r.json()["users"]}
+    for u in SEED_USERS:
+        if u["username"] in ids:
+            continue
         r = client.post("/users", json=u)
         # If the session-level seeding already populated these users, accept a 400 'Username already exists'
-        if r.status_code not in (200, 201):
-            assert r.status_code == 400 and "Username already exists" in r.text, f"Failed to create seed user {u['username']}: {r.text}"
-    return users
+        assert r.status_code == 400 and "Username already exists" in r.text, f"Failed to create seed user {u['username']}: {r.text}"
+    # Missing ids come from /login, so those users are logged in once and their tokens kept
+    wanted = [u["username"] for u in SEED_USERS if u["username"] not in ids or u["username"] in login]
+    bodies = login_seed_users(client, wanted)
+    ids.update((name, b["user_id"]) for name, b in bodies.items())
+    return SeedUsers(ids, {name: b["token"] for name, b in bodies.items()})
 
 
-def test_seeded_users_login_and_update(client):
-    # Ensure seed users exist in the app for this test (created in-test)
-    create_seed_users(client)
+@pytest.fixture
+def seed_users(client):
+    # With TESTS_USE_SEED_DATA=1 the session-wide seed in conftest already holds these users
+    # and clean_state keeps them, so skip the POSTs. Otherwise clean_state wipes users_db
+    # around every test, so they are created per test. Either way john_doe is logged in once.
+    if os.environ.get("TESTS_USE_SEED_DATA", "0") == "1":
+        bodies = login_seed_users(client, [u["username"] for u in SEED_USERS])
+        return SeedUsers({n: b["user_id"] for n, b in bodies.items()}, {n: b["token"] for n, b in bodies.items()})
+    return create_seed_users(client, login=("john_doe",))
 
-    # Login as john_doe
-    r = client.post("/login", json={"username": "john_doe", "password": "password123"})
-    assert r.status_code == 200, r.text
-    token = r.json().get("token")
-    assert token, "No token returned"
 
-    headers = {"Authorization": f"Bearer {token}"}
+def test_seeded_users_login_and_update(client, seed_users):
 
-    # Fetch john_doe by listing users and filtering by username (avoid /users/search route collision)
-    rl = client.get("/users", params={"limit": 50, "offset": 0, "sort_by": "id", "order": "asc"})
-    assert rl.status_code == 200, rl.text
-    users = rl.json()
-    matches = [u for u in users if u.get("username") == "john_doe"]
-    assert len(matches) == 1, f"expected john_doe to be present in listing, got: {matches}"
-    user = matches[0]
+    # john_doe's token comes from the fixture's /login
+    headers = {"Authorization": f"Bearer {seed_users.tokens['john_doe']}"}
 
     # Update john_doe's phone
     new_phone = "+15559998877"
-    r_up = client.put(f"/users/{user['id']}", json={"phone": new_phone}, headers=headers)
+    r_up = client.put(f"/users/{seed_users.ids['john_doe']}", json={"phone": new_phone}, headers=headers)
     assert r_up.status_code == 200, r_up.text
     updated = r_up.json()
     assert updated['phone'] == new_phone
-